@@ -0,0 +1,31 @@
+"""
+Convert the Excel databases to Parquet
+Run after editing pattern_database.xlsx or Database_YARN.xlsx; the app and
+the matcher read a .parquet copy only while it matches its Excel file.
+"""
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from slice10_yarn_match import PATTERN_DB, SOURCE_HASH_KEY, YARN_DB, YARN_COLUMNS, file_hash, parquet_path
+
+def convert_database(xlsx_path, columns=None):
+    """Write a typed Parquet copy of one Excel database."""
+    df = pd.read_excel(xlsx_path, usecols=columns)
+    
+    # Mixed-type columns (e.g. ratings with '??', hook sizes with text) are kept as strings
+    for column in df.columns:
+        if df[column].dtype == object:
+            df[column] = df[column].astype('string')
+    
+    # Record which Excel contents this copy was made from
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = {**(table.schema.metadata or {}), SOURCE_HASH_KEY: file_hash(xlsx_path).encode()}
+    pq.write_table(table.replace_schema_metadata(metadata), parquet_path(xlsx_path), compression='zstd')
+    return df
+
+if __name__ == "__main__":
+    for xlsx_path, columns in [(PATTERN_DB, None), (YARN_DB, YARN_COLUMNS)]:
+        df = convert_database(xlsx_path, columns)
+        print(f"✅ {xlsx_path} -> {parquet_path(xlsx_path)} ({len(df)} rows, {len(df.columns)} columns)")
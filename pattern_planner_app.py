@@ -5,7 +5,9 @@ From pattern selection to purchase links and inspiration
 
 import streamlit as st
 import pandas as pd
+import numpy as np
 import chromadb
+from chromadb.errors import ChromaError
 from datetime import datetime
 import os
 
@@ -13,10 +15,13 @@ import os
 import sys
 sys.path.append('.')
 
-from slice10_yarn_match import calculate_match_score, load_databases, normalize_yarn_weight
+from slice10_yarn_match import (
+    PATTERN_DB, PATTERN_MATCH_FIELDS, YARN_DB, calculate_match_scores_batch, load_databases,
+    normalize_yarn_weight, top_k_indices
+)
 
-# Temperature-based location data (average temps in Celsius)
-LOCATION_TEMPS = {
+# Temperature-based location data (average temps in Celsius), one row per location
+LOCATION_TEMPS = pd.DataFrame.from_dict({
     "Sweden (Stockholm)": {"winter": -3, "spring": 5, "summer": 18, "fall": 8},
     "Spain (Madrid)": {"winter": 6, "spring": 14, "summer": 25, "fall": 15},
     "UK (London)": {"winter": 5, "spring": 11, "summer": 18, "fall": 12},
@@ -28,7 +33,7 @@ LOCATION_TEMPS = {
     "Italy (Rome)": {"winter": 8, "spring": 14, "summer": 25, "fall": 17},
     "Netherlands (Amsterdam)": {"winter": 3, "spring": 10, "summer": 17, "fall": 11},
     "Custom": {"winter": 10, "spring": 15, "summer": 20, "fall": 12}
-}
+}, orient="index")
 
 # Page config
 st.set_page_config(
@@ -38,21 +43,67 @@ st.set_page_config(
 )
 
 # Initialize
+def _mtime(xlsx_path):
+    """Modification time of a database's Excel file (the source of truth)"""
+    return os.path.getmtime(xlsx_path)
+
 @st.cache_data
-def load_data():
+def load_data(pattern_mtime, yarn_mtime):
+    """Load and index both databases; the mtimes only key the cache so edited Excel files reload.
+    
+    load_databases checks each Parquet copy against its Excel contents, so a reload
+    after an Excel edit picks up the new data even before the copies are regenerated.
+    """
     patterns_df, yarn_df = load_databases()
-    return patterns_df, yarn_df
+    
+    # Get unique patterns (remove duplicates)
+    unique_patterns = patterns_df.drop_duplicates(subset=['Pattern Name']).reset_index(drop=True)
+    
+    # Lowercased text searched by the sidebar, built once instead of per keystroke
+    unique_patterns['_search_blob'] = (
+        unique_patterns['Pattern Name'].fillna('') + ' ' +
+        unique_patterns['Pattern Structure'].fillna('') + ' ' +
+        unique_patterns['Stitches Required'].fillna('')
+    ).str.lower()
+    
+    # Stitch pills for Section 2, rendered once per pattern
+    unique_patterns['_stitch_list'] = unique_patterns['Stitches Required'].fillna('').str.split(',')
+    unique_patterns['_stitch_html'] = unique_patterns['_stitch_list'].apply(
+        lambda stitches: ''.join(
+            f'<span style="background-color: #E8F4F8; padding: 5px 10px; border-radius: 15px; margin: 5px; display: inline-block;">{stitch.strip()}</span>'
+            for stitch in stitches
+        )
+    )
+    
+    # Low-cardinality text columns as categoricals (integer codes instead of strings)
+    for column in ['Difficulty Level', 'Yarn Weight']:
+        unique_patterns[column] = unique_patterns[column].astype('category')
+    yarn_df['Yarn thikness'] = yarn_df['Yarn thikness'].astype('category')
+    
+    # Row positions per filter value, so sidebar filters are index intersections
+    filter_groups = {
+        column: unique_patterns.groupby(column, observed=True).indices
+        for column in ['Difficulty Level', 'Yarn Weight']
+    }
+    
+    # Hashed lookup of the selected pattern by name
+    patterns_by_name = unique_patterns.set_index('Pattern Name', drop=False)
+    return unique_patterns, filter_groups, patterns_by_name, yarn_df
 
 @st.cache_resource
 def load_vector_db():
     try:
         client = chromadb.PersistentClient(path="./chroma_db")
         collection = client.get_collection(name="crochet_patterns")
-        return client, collection
-    except:
+    except (FileNotFoundError, ValueError, ChromaError):
         # Vector DB not available in deployment - return None
         return None, None
+    
+    # Warm-up read so the first real query doesn't pay the cold-start cost
+    collection.peek(1)
+    return client, collection
 
+@st.cache_data(ttl=3600)
 def get_current_season():
     """Determine current season based on month"""
     month = datetime.now().month
@@ -67,49 +118,91 @@ def get_current_season():
 
 def get_temp_for_location_and_season(location, season):
     """Get average temperature for location and season"""
-    return LOCATION_TEMPS.get(location, LOCATION_TEMPS["Custom"])[season]
-
-def get_yarn_temp_range(yarn_row):
-    """Determine comfortable temperature range for yarn based on composition"""
-    cotton = yarn_row.get('Cotton (%)', 0)
-    linen = yarn_row.get('Linen (%)', 0)
-    bamboo = yarn_row.get('Bamboo/Viscouse (%)', 0)
-    acrylic = yarn_row.get('Acrylic (%)', 0)
-    wool = yarn_row.get('Wool (%)', 0)
-    mohair = yarn_row.get('Mohair/Alpaca (%)', 0)
+    if location not in LOCATION_TEMPS.index:
+        location = "Custom"
+    return LOCATION_TEMPS.at[location, season]
+
+@st.cache_data
+def get_yarn_temp_ranges(yarn_key, _yarn_df):
+    """Determine comfortable temperature range for every yarn based on composition"""
+    cotton = _yarn_df['Cotton (%)'].to_numpy()
+    linen = _yarn_df['Linen (%)'].to_numpy()
+    bamboo = _yarn_df['Bamboo/Viscouse (%)'].to_numpy()
+    acrylic = _yarn_df['Acrylic (%)'].to_numpy()
+    wool = _yarn_df['Wool (%)'].to_numpy()
+    mohair = _yarn_df['Mohair/Alpaca (%)'].to_numpy()
     
     # Calculate warmth based on fiber composition
     cool_fiber_pct = cotton + linen + bamboo  # Breathable, cool
     warm_fiber_pct = wool + mohair  # Insulating, warm
     
-    if warm_fiber_pct > 50:
-        return {"min": -10, "max": 15, "ideal": 5, "type": "Warm (Wool/Alpaca)"}
-    elif cool_fiber_pct > 50:
-        return {"min": 15, "max": 35, "ideal": 22, "type": "Cool (Cotton/Linen)"}
-    elif acrylic > 70:
-        return {"min": 5, "max": 20, "ideal": 12, "type": "All-season (Acrylic)"}
-    else:
-        return {"min": 5, "max": 25, "ideal": 15, "type": "Blend"}
+    conditions = [warm_fiber_pct > 50, cool_fiber_pct > 50, acrylic > 70]
+    return pd.DataFrame({
+        "min": np.select(conditions, [-10, 15, 5], default=5),
+        "max": np.select(conditions, [15, 35, 20], default=25),
+        "ideal": np.select(conditions, [5, 22, 12], default=15),
+        "type": np.select(conditions, ["Warm (Wool/Alpaca)", "Cool (Cotton/Linen)", "All-season (Acrylic)"], default="Blend"),
+    }, index=_yarn_df.index)
+
+def calculate_temp_match_scores(yarn_temp_ranges, current_temp):
+    """Calculate how well each yarn matches current temperature (0-30 points)"""
+    current_temp = np.float64(current_temp)
+    yarn_min = yarn_temp_ranges["min"].to_numpy()
+    yarn_max = yarn_temp_ranges["max"].to_numpy()
+    yarn_ideal = yarn_temp_ranges["ideal"].to_numpy()
+    
+    # Inside range - distance from ideal; outside range - steep penalty
+    inside = (yarn_min <= current_temp) & (current_temp <= yarn_max)
+    distance_outside = np.where(current_temp < yarn_min, yarn_min - current_temp, current_temp - yarn_max)
+    score = np.where(inside, 30 - (np.abs(current_temp - yarn_ideal) * 1.5), 30 - (distance_outside * 3))
+    return np.maximum(0, score)
 
-def calculate_temp_match_score(yarn_temp_range, current_temp):
-    """Calculate how well yarn matches current temperature (0-30 points)"""
-    yarn_min = yarn_temp_range["min"]
-    yarn_max = yarn_temp_range["max"]
-    yarn_ideal = yarn_temp_range["ideal"]
+@st.cache_data
+def base_scores_for_pattern(pattern_key, yarn_key, _yarn_df):
+    """Pattern match score for every yarn, cached on the pattern fields the score reads and the yarn key"""
+    pattern_row = dict(zip(PATTERN_MATCH_FIELDS, pattern_key))
+    return calculate_match_scores_batch(pattern_row, _yarn_df)
+
+@st.cache_data(show_spinner=False)
+def top_yarn_matches(pattern_key, current_temp, yarn_key, _yarn_df, top_n=3):
+    """Best yarns for a pattern at the current temperature, ready for display
     
-    if yarn_min <= current_temp <= yarn_max:
-        # Inside range - calculate distance from ideal
-        distance_from_ideal = abs(current_temp - yarn_ideal)
-        score = 30 - (distance_from_ideal * 1.5)
-        return max(0, score)
-    else:
-        # Outside range - steep penalty
-        if current_temp < yarn_min:
-            distance = yarn_min - current_temp
-        else:
-            distance = current_temp - yarn_max
-        score = 30 - (distance * 3)
-        return max(0, score)
+    The yarn cached functions key on yarn_key (the yarn database mtime); the
+    leading underscore tells Streamlit not to hash _yarn_df itself.
+    """
+    # Calculate match scores for all yarns at once
+    # Base pattern match score (only recomputed when the pattern changes)
+    base_score = base_scores_for_pattern(pattern_key, yarn_key, _yarn_df)
+    
+    # Temperature suitability score
+    yarn_temp_ranges = get_yarn_temp_ranges(yarn_key, _yarn_df)
+    temp_score = calculate_temp_match_scores(yarn_temp_ranges, current_temp)
+    
+    # Combined: 70% pattern match + 30% temperature match
+    total_score = (base_score * 0.7) + temp_score
+    
+    # Get top N without sorting every yarn
+    top_idx = top_k_indices(total_score, top_n)
+    top_yarns = _yarn_df.iloc[top_idx]
+    top_temp_ranges = yarn_temp_ranges.iloc[top_idx]
+    
+    return pd.DataFrame({
+        'yarn_name': top_yarns['Name of the product'],
+        'score': total_score[top_idx],
+        'base_score': base_score[top_idx],
+        'temp_score': temp_score[top_idx],
+        'price': top_yarns['Price (€)'],
+        'rating': top_yarns['_rating_f'],
+        'brand': top_yarns['Brand'],
+        'temp_min': top_temp_ranges['min'],
+        'temp_max': top_temp_ranges['max'],
+        'temp_ideal': top_temp_ranges['ideal'],
+        'temp_type': top_temp_ranges['type'],
+        'cotton': top_yarns['Cotton (%)'],
+        'acrylic': top_yarns['Acrylic (%)'],
+        'wool': top_yarns['Wool (%)'],
+        'weight': top_yarns['Yarn thikness']
+    })
 
 def determine_yarn_season(yarn_row):
     """Determine if yarn is suitable for current season based on composition"""
@@ -131,6 +224,17 @@ def determine_yarn_season(yarn_row):
     else:
         return "Spring/Fall"
 
+@st.cache_data
+def pdf_exists(pdf_path):
+    """Check once per path whether the pattern PDF is available"""
+    return os.path.exists(pdf_path)
+
+@st.cache_data
+def load_pdf_bytes(pdf_path):
+    """Read a pattern PDF once and serve it from the cache afterwards"""
+    with open(pdf_path, 'rb') as f:
+        return f.read()
+
 def get_yarn_store_url(yarn_name, brand):
     """Generate potential store URLs for yarn"""
     # This is a simplified version - you'd need actual URL mapping
@@ -149,11 +253,11 @@ def get_yarn_store_url(yarn_name, brand):
     return urls
 
 # Load data
-patterns_df, yarn_df = load_data()
+# The yarn database mtime doubles as the cheap cache key for yarn-derived results
+yarn_key = _mtime(YARN_DB)
+unique_patterns, filter_groups, patterns_by_name, yarn_df = load_data(_mtime(PATTERN_DB), yarn_key)
 client, collection = load_vector_db()
 
-# Get unique patterns (remove duplicates)
-unique_patterns = patterns_df.drop_duplicates(subset=['Pattern Name'])
 current_season = get_current_season()
 
 # Header
@@ -165,7 +269,7 @@ col_header1, col_header2 = st.columns([2, 1])
 with col_header1:
     user_location = st.selectbox(
         "📍 Your Location",
-        list(LOCATION_TEMPS.keys()),
+        LOCATION_TEMPS.index.tolist(),
         index=0,
         help="Select your location for temperature-based yarn recommendations"
     )
@@ -194,26 +298,26 @@ search_query = st.sidebar.text_input("Search patterns", placeholder="e.g., baby
 
 # Filters
 st.sidebar.subheader("Filters")
-difficulties = ["All"] + sorted(unique_patterns['Difficulty Level'].dropna().unique().tolist())
+difficulties = ["All"] + unique_patterns['Difficulty Level'].cat.categories.tolist()
 selected_difficulty = st.sidebar.selectbox("Difficulty", difficulties)
 
-weights = ["All"] + sorted(unique_patterns['Yarn Weight'].dropna().unique().tolist())
+weights = ["All"] + unique_patterns['Yarn Weight'].cat.categories.tolist()
 selected_weight = st.sidebar.selectbox("Yarn Weight", weights)
 
 # Apply filters
-filtered_df = unique_patterns.copy()
+selected_rows = unique_patterns.index
 
 if selected_difficulty != "All":
-    filtered_df = filtered_df[filtered_df['Difficulty Level'] == selected_difficulty]
+    selected_rows = selected_rows.intersection(pd.Index(filter_groups['Difficulty Level'][selected_difficulty]))
 
 if selected_weight != "All":
-    filtered_df = filtered_df[filtered_df['Yarn Weight'] == selected_weight]
+    selected_rows = selected_rows.intersection(pd.Index(filter_groups['Yarn Weight'][selected_weight]))
+
+filtered_df = unique_patterns.iloc[selected_rows]
 
 if search_query:
-    # Simple text search
-    mask = filtered_df['Pattern Name'].str.contains(search_query, case=False, na=False) | \
-           filtered_df['Pattern Structure'].str.contains(search_query, case=False, na=False) | \
-           filtered_df['Stitches Required'].str.contains(search_query, case=False, na=False)
+    # Simple text search (plain substring match, no regex)
+    mask = filtered_df['_search_blob'].str.contains(search_query.lower(), regex=False, na=False)
     filtered_df = filtered_df[mask]
 
 # Main area - Pattern selection
@@ -226,7 +330,7 @@ selected_pattern_name = st.sidebar.selectbox(
 )
 
 # Get selected pattern details
-selected_pattern = filtered_df[filtered_df['Pattern Name'] == selected_pattern_name].iloc[0]
+selected_pattern = patterns_by_name.loc[selected_pattern_name]
 
 # MAIN CONTENT - PROJECT PLANNING
 
@@ -247,16 +351,10 @@ st.markdown("---")
 
 # Section 2: Stitches Needed
 st.subheader("🪡 Stitches You'll Need")
-stitches = str(selected_pattern['Stitches Required']).split(',')
 st.markdown("**Required stitches:**")
 
-# Display stitches as pills
-stitch_html = ""
-for stitch in stitches:
-    stitch = stitch.strip()
-    stitch_html += f'<span style="background-color: #E8F4F8; padding: 5px 10px; border-radius: 15px; margin: 5px; display: inline-block;">{stitch}</span>'
-
-st.markdown(stitch_html, unsafe_allow_html=True)
+# Display stitches as pills (pre-rendered in load_data)
+st.markdown(selected_pattern['_stitch_html'], unsafe_allow_html=True)
 
 st.markdown("""
 💡 **New to these stitches?** Search YouTube for tutorials:
@@ -269,53 +367,24 @@ st.markdown("---")
 # Section 3: Yarn Recommendations (TEMPERATURE-AWARE)
 st.subheader(f"🧵 Top Yarn Recommendations for {current_temp}°C")
 
-# Calculate match scores for all yarns
-yarn_matches = []
-for idx, yarn_row in yarn_df.iterrows():
-    # Base pattern match score
-    base_score = calculate_match_score(selected_pattern, yarn_row)
-    
-    # Temperature suitability score
-    yarn_temp_range = get_yarn_temp_range(yarn_row)
-    temp_score = calculate_temp_match_score(yarn_temp_range, current_temp)
-    
-    # Combined: 70% pattern match + 30% temperature match
-    total_score = (base_score * 0.7) + temp_score
-    
-    yarn_matches.append({
-        'name': yarn_row['Name of the product'],
-        'score': total_score,
-        'base_score': base_score,
-        'temp_score': temp_score,
-        'price': yarn_row['Price (€)'],
-        'rating': yarn_row['Rating (★)'],
-        'brand': yarn_row.get('Brand', 'Unknown'),
-        'temp_range': yarn_temp_range,
-        'cotton': yarn_row.get('Cotton (%)', 0),
-        'acrylic': yarn_row.get('Acrylic (%)', 0),
-        'wool': yarn_row.get('Wool (%)', 0),
-        'weight': yarn_row.get('Yarn thikness', 'Unknown')
-    })
-
-# Sort and get top 3
-yarn_matches_df = pd.DataFrame(yarn_matches).sort_values('score', ascending=False).head(3)
+# Top 3 yarns for this pattern and temperature (cached per pattern + temperature)
+yarn_matches_df = top_yarn_matches(tuple(selected_pattern[PATTERN_MATCH_FIELDS]), current_temp, yarn_key, yarn_df)
 
-for idx, yarn in yarn_matches_df.iterrows():
-    with st.expander(f"✨ {yarn['name']} - {yarn['score']:.0f}% Match", expanded=(idx==0)):
+for yarn in yarn_matches_df.itertuples():
+    with st.expander(f"✨ {yarn.yarn_name} - {yarn.score:.0f}% Match", expanded=(yarn.Index == 0)):
         col1, col2 = st.columns([2, 1])
         
         with col1:
-            st.markdown(f"**Price:** €{yarn['price']:.2f} per ball")
-            st.markdown(f"**Rating:** {'⭐' * int(yarn['rating'])}")
+            st.markdown(f"**Price:** €{yarn.price:.2f} per ball")
+            st.markdown(f"**Rating:** {'⭐' * int(yarn.rating)}")
             
             # Temperature comfort info
-            temp_range = yarn['temp_range']
-            st.markdown(f"**Fiber Type:** {temp_range['type']}")
-            st.markdown(f"**Comfort Range:** {temp_range['min']}°C to {temp_range['max']}°C (ideal: {temp_range['ideal']}°C)")
+            st.markdown(f"**Fiber Type:** {yarn.temp_type}")
+            st.markdown(f"**Comfort Range:** {yarn.temp_min}°C to {yarn.temp_max}°C (ideal: {yarn.temp_ideal}°C)")
             
             # Temperature match indicator
-            if temp_range['min'] <= current_temp <= temp_range['max']:
-                distance = abs(current_temp - temp_range['ideal'])
+            if yarn.temp_min <= current_temp <= yarn.temp_max:
+                distance = abs(current_temp - yarn.temp_ideal)
                 if distance <= 3:
                     st.success(f"🌡️ Perfect for {current_temp}°C!")
                 elif distance <= 7:
@@ -323,33 +392,33 @@ for idx, yarn in yarn_matches_df.iterrows():
                 else:
                     st.warning(f"⚠️ Usable at {current_temp}°C but not ideal")
             else:
-                if current_temp < temp_range['min']:
-                    st.error(f"❄️ Too cold for this yarn ({current_temp}°C < {temp_range['min']}°C)")
+                if current_temp < yarn.temp_min:
+                    st.error(f"❄️ Too cold for this yarn ({current_temp}°C < {yarn.temp_min}°C)")
                 else:
-                    st.error(f"🔥 Too hot for this yarn ({current_temp}°C > {temp_range['max']}°C)")
+                    st.error(f"🔥 Too hot for this yarn ({current_temp}°C > {yarn.temp_max}°C)")
             
-            st.markdown(f"**Weight:** {yarn['weight']}")
+            st.markdown(f"**Weight:** {yarn.weight}")
             
             # Composition
             comp_parts = []
-            if yarn['cotton'] > 0:
-                comp_parts.append(f"{int(yarn['cotton'])}% Cotton")
-            if yarn['acrylic'] > 0:
-                comp_parts.append(f"{int(yarn['acrylic'])}% Acrylic")
-            if yarn['wool'] > 0:
-                comp_parts.append(f"{int(yarn['wool'])}% Wool")
+            if yarn.cotton > 0:
+                comp_parts.append(f"{int(yarn.cotton)}% Cotton")
+            if yarn.acrylic > 0:
+                comp_parts.append(f"{int(yarn.acrylic)}% Acrylic")
+            if yarn.wool > 0:
+                comp_parts.append(f"{int(yarn.wool)}% Wool")
             
             st.markdown(f"**Composition:** {', '.join(comp_parts)}")
             
             # Score breakdown
             with st.expander("📊 Score Breakdown"):
-                st.markdown(f"- Pattern Match: {yarn['base_score']:.1f}%")
-                st.markdown(f"- Temperature Match: {yarn['temp_score']:.1f}/30 pts")
-                st.markdown(f"- **Total: {yarn['score']:.1f}%**")
+                st.markdown(f"- Pattern Match: {yarn.base_score:.1f}%")
+                st.markdown(f"- Temperature Match: {yarn.temp_score:.1f}/30 pts")
+                st.markdown(f"- **Total: {yarn.score:.1f}%**")
         
         with col2:
             st.markdown("**Where to Buy:**")
-            urls = get_yarn_store_url(yarn['name'], yarn['brand'])
+            urls = get_yarn_store_url(yarn.yarn_name, yarn.brand)
             for url in urls:
                 if 'hobbii' in url:
                     st.markdown(f"🛒 [Hobbii.com]({url})")
@@ -391,13 +460,10 @@ st.subheader("📄 Pattern PDF")
 pdf_filename = selected_pattern['Source File']
 pdf_path = os.path.join('PDFPatterns', pdf_filename)
 
-if os.path.exists(pdf_path):
-    with open(pdf_path, 'rb') as f:
-        pdf_bytes = f.read()
-    
+if pdf_exists(pdf_path):
     st.download_button(
         label="📥 Download Pattern PDF",
-        data=pdf_bytes,
+        data=load_pdf_bytes(pdf_path),
         file_name=pdf_filename,
         mime="application/pdf"
     )
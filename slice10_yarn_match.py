@@ -3,15 +3,88 @@ Slice 10: Pattern-Yarn Matching Algorithm
 Goal: Match patterns to suitable yarns based on multiple criteria
 """
 
+import hashlib
+import os
+import warnings
+from collections import OrderedDict
+from functools import lru_cache
+from math import isnan
+
 import pandas as pd
 import numpy as np
+import pyarrow.parquet as pq
+
+PATTERN_DB = 'pattern_database.xlsx'
+YARN_DB = 'Database_YARN.xlsx'
+
+# Parquet schema metadata key holding the SHA-256 of the Excel file it was converted from
+SOURCE_HASH_KEY = b'source_sha256'
+
+# Yarn columns the matcher and the app actually use
+YARN_COLUMNS = [
+    'Name of the product', 'Price (€)', 'Cotton (%)', 'Acrylic (%)', 'Wool (%)',
+    'Bamboo/Viscouse (%)', 'Linen (%)', 'Mohair/Alpaca (%)', 'Yarn thikness',
+    'Needle/Hook Size (mm)', 'Rating (★)', 'Brand'
+]
+
+# Fibers a pattern's recommended composition can ask for, with their yarn columns
+COMP_FIBERS = [('cotton', 'Cotton (%)'), ('acrylic', 'Acrylic (%)'), ('wool', 'Wool (%)')]
+
+# Pattern columns read by the match score; a pattern's score depends on nothing else
+PATTERN_MATCH_FIELDS = ['_weight_code', '_hook_f', 'Recommended Composition']
+
+def parquet_path(xlsx_path):
+    """Path of the Parquet copy of an Excel database."""
+    return os.path.splitext(xlsx_path)[0] + '.parquet'
+
+def file_hash(path):
+    """SHA-256 hex digest of a file's contents."""
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def read_database(xlsx_path, columns=None):
+    """Read a database from its Parquet copy if it matches the Excel file, else from the Excel file."""
+    pq_path = parquet_path(xlsx_path)
+    if os.path.exists(pq_path):
+        metadata = pq.read_schema(pq_path).metadata or {}
+        if metadata.get(SOURCE_HASH_KEY, b'').decode() == file_hash(xlsx_path):
+            return pd.read_parquet(pq_path, columns=columns)
+        warnings.warn(f"{pq_path} is out of date with {xlsx_path}; reading the Excel file "
+                      f"(run convert_databases.py to refresh it)")
+    return pd.read_excel(xlsx_path, usecols=columns)
 
 def load_databases():
     """Load both pattern and yarn databases."""
-    patterns_df = pd.read_excel('pattern_database.xlsx')
-    yarn_df = pd.read_excel('Database_YARN.xlsx')
+    patterns_df = read_database(PATTERN_DB)
+    yarn_df = read_database(YARN_DB, columns=YARN_COLUMNS)
+    add_match_columns(patterns_df, yarn_df)
     return patterns_df, yarn_df
 
+def add_match_columns(patterns_df, yarn_df):
+    """Precompute the derived columns the match score reads, once per load."""
+    patterns_df['_hook_f'] = pd.to_numeric(patterns_df['Hook Size (mm)'].astype(str).str.strip(), errors='coerce').astype('float64')
+    
+    # Normalized weights share one category list across both frames, so the
+    # integer codes index straight into weight_compat_matrix (-1 = missing)
+    pattern_weights = patterns_df['Yarn Weight'].map(normalize_yarn_weight)
+    yarn_weights = yarn_df['Yarn thikness'].map(normalize_yarn_weight)
+    weight_categories = sorted(set(pattern_weights.dropna()) | set(yarn_weights.dropna()))
+    patterns_df['_weight_norm'] = pd.Categorical(pattern_weights, categories=weight_categories)
+    yarn_df['_weight_norm'] = pd.Categorical(yarn_weights, categories=weight_categories)
+    patterns_df['_weight_code'] = patterns_df['_weight_norm'].cat.codes
+    yarn_df['_weight_code'] = yarn_df['_weight_norm'].cat.codes
+    
+    # Numeric yarn columns as plain float64, NaN when missing or unparseable
+    # (string columns from Parquet would otherwise coerce to nullable Float64)
+    yarn_df['_hook_f'] = pd.to_numeric(yarn_df['Needle/Hook Size (mm)'].astype(str).str.strip(), errors='coerce').astype('float64')
+    price = pd.to_numeric(yarn_df['Price (€)'], errors='coerce').astype('float64')
+    yarn_df['_price_f'] = price
+    # A price that is present but unparseable keeps the 7.5-point default
+    yarn_df['_price_bad'] = price.isna() & yarn_df['Price (€)'].notna()
+    rating = pd.to_numeric(yarn_df['Rating (★)'], errors='coerce').astype('float64')
+    # A rating that is present but unparseable (e.g. '??') scores as a neutral 2.5 stars
+    yarn_df['_rating_f'] = rating.where(rating.notna() | yarn_df['Rating (★)'].isna(), 2.5)
+
 def normalize_yarn_weight(weight):
     """Normalize yarn weight names for matching."""
     if pd.isna(weight):
@@ -37,52 +110,64 @@ def normalize_yarn_weight(weight):
     
     return weight
 
+def weight_match_points(pattern_weight, yarn_weight):
+    """Score two normalized yarn weights against each other (0, 15 or 30 points)."""
+    if isinstance(pattern_weight, str) and isinstance(yarn_weight, str) and pattern_weight and yarn_weight:
+        if pattern_weight.lower() in yarn_weight.lower() or yarn_weight.lower() in pattern_weight.lower():
+            return 30
+        # Partial match for compatible weights
+        compatible = {
+            'sport': ['DK'],
+            'DK': ['sport', 'worsted'],
+            'worsted': ['DK', 'bulky'],
+            'bulky': ['worsted', 'super bulky']
+        }
+        if pattern_weight in compatible and yarn_weight in compatible.get(pattern_weight, []):
+            return 15
+    return 0
+
+@lru_cache(maxsize=8)
+def weight_compat_matrix(weight_categories):
+    """int8 lookup table of weight_match_points for every pair of weight codes.
+    
+    Row/column i is weight_categories[i]; the extra last row and column are
+    zeros, so a missing weight (code -1) scores 0 against everything.
+    """
+    n = len(weight_categories)
+    compat = np.zeros((n + 1, n + 1), dtype=np.int8)
+    for i, pattern_weight in enumerate(weight_categories):
+        for j, yarn_weight in enumerate(weight_categories):
+            compat[i, j] = weight_match_points(pattern_weight, yarn_weight)
+    return compat
+
 def calculate_match_score(pattern_row, yarn_row):
-    """Calculate how well a yarn matches a pattern (0-100 score)."""
+    """Calculate how well a yarn matches a pattern (0-100 score).
+    
+    Readable per-pair reference for the scoring rules. The app and
+    match_yarn_to_pattern use calculate_match_scores_batch, which must stay in
+    sync with this function.
+    """
     
     score = 0
     max_score = 0
     
     # 1. Yarn Weight Match (30 points) - CRITICAL
     max_score += 30
-    pattern_weight = normalize_yarn_weight(pattern_row['Yarn Weight'])
-    yarn_weight = normalize_yarn_weight(yarn_row['Yarn thikness'])
-    
-    if pattern_weight and yarn_weight:
-        if pattern_weight.lower() in yarn_weight.lower() or yarn_weight.lower() in pattern_weight.lower():
-            score += 30
-        else:
-            # Partial match for compatible weights
-            compatible = {
-                'sport': ['DK'],
-                'DK': ['sport', 'worsted'],
-                'worsted': ['DK', 'bulky'],
-                'bulky': ['worsted', 'super bulky']
-            }
-            if pattern_weight in compatible and yarn_weight in compatible.get(pattern_weight, []):
-                score += 15
+    score += weight_match_points(pattern_row['_weight_norm'], yarn_row['_weight_norm'])
     
     # 2. Hook Size Match (20 points)
     max_score += 20
-    pattern_hook = pattern_row['Hook Size (mm)']
-    yarn_hook = yarn_row['Needle/Hook Size (mm)']
+    pattern_hook = pattern_row['_hook_f']
+    yarn_hook = yarn_row['_hook_f']
     
-    if pd.notna(pattern_hook) and pd.notna(yarn_hook):
-        try:
-            # Clean and convert hook sizes
-            pattern_hook_clean = str(pattern_hook).strip()
-            yarn_hook_clean = str(yarn_hook).strip()
-            
-            if pattern_hook_clean and yarn_hook_clean and pattern_hook_clean != ' ':
-                hook_diff = abs(float(pattern_hook_clean) - float(yarn_hook_clean))
-                if hook_diff == 0:
-                    score += 20
-                elif hook_diff <= 0.5:
-                    score += 15
-                elif hook_diff <= 1.0:
-                    score += 10
-        except (ValueError, TypeError):
-            pass  # Skip if can't convert
+    if not isnan(pattern_hook) and not isnan(yarn_hook):
+        hook_diff = abs(pattern_hook - yarn_hook)
+        if hook_diff == 0:
+            score += 20
+        elif hook_diff <= 0.5:
+            score += 15
+        elif hook_diff <= 1.0:
+            score += 10
     
     # 3. Yarn Composition Suitability (20 points)
     max_score += 20
@@ -99,60 +184,119 @@ def calculate_match_score(pattern_row, yarn_row):
     
     # 4. Rating (15 points)
     max_score += 15
-    rating = yarn_row['Rating (★)']
-    if pd.notna(rating):
-        try:
-            score += (float(rating) / 5.0) * 15
-        except (ValueError, TypeError):
-            score += 7.5  # Default if rating can't be converted
+    rating = yarn_row['_rating_f']
+    if not isnan(rating):
+        score += (rating / 5.0) * 15
     
     # 5. Price/Value (15 points) - Lower is better
     max_score += 15
-    price = yarn_row['Price (€)']
-    if pd.notna(price):
-        try:
-            price = float(price)
-            if price < 3:
-                score += 15
-            elif price < 5:
-                score += 10
-            elif price < 8:
-                score += 5
-        except (ValueError, TypeError):
-            score += 7.5  # Default if price can't be converted
+    price = yarn_row['_price_f']
+    if not isnan(price):
+        if price < 3:
+            score += 15
+        elif price < 5:
+            score += 10
+        elif price < 8:
+            score += 5
+    elif yarn_row['_price_bad']:
+        score += 7.5  # Default if price can't be converted
     
     # Calculate percentage
     if max_score > 0:
         return (score / max_score) * 100
     return 0
 
+def calculate_match_scores_batch(pattern_row, yarn_df):
+    """Batched calculate_match_score: score one pattern against every yarn (0-100 array)."""
+    
+    compat = weight_compat_matrix(tuple(yarn_df['_weight_norm'].cat.categories))
+    composition_text = str(pattern_row['Recommended Composition']).lower()
+    comp_fibers = np.array([fiber in composition_text for fiber, _ in COMP_FIBERS])
+    comp_default = 10 if 'not specified' in composition_text else 0
+    
+    # 1. Yarn Weight Match (30 points) - one lookup-table row, indexed by yarn weight code
+    weight_score = compat[pattern_row['_weight_code'], yarn_df['_weight_code'].to_numpy()]
+    
+    # 2. Hook Size Match (20 points) - NaN hook sizes fail every comparison
+    hook_diff = np.abs(yarn_df['_hook_f'].to_numpy() - pattern_row['_hook_f'])
+    hook_score = np.select([hook_diff == 0, hook_diff <= 0.5, hook_diff <= 1.0], [20, 15, 10], default=0)
+    
+    # 3. Yarn Composition Suitability (20 points)
+    comp_match = np.zeros(len(yarn_df), dtype=bool)
+    for wanted, (_, column) in zip(comp_fibers, COMP_FIBERS):
+        if wanted:
+            comp_match |= yarn_df[column].to_numpy() > 50
+    comp_score = np.where(comp_match, 20, comp_default)
+    
+    # 4. Rating (15 points)
+    rating_score = np.nan_to_num(yarn_df['_rating_f'].to_numpy(), nan=0.0) / 5.0 * 15
+    
+    # 5. Price/Value (15 points) - Lower is better
+    price = yarn_df['_price_f'].to_numpy()
+    price_score = np.select([price < 3, price < 5, price < 8, yarn_df['_price_bad'].to_numpy()], [15, 10, 5, 7.5], default=0)
+    
+    max_score = 30 + 20 + 20 + 15 + 15
+    score = weight_score + hook_score + comp_score + rating_score + price_score
+    return (score / max_score) * 100
+
+def top_k_indices(scores, k):
+    """Positions of the k highest scores, best first; ties keep row order."""
+    k = min(k, len(scores))
+    if k == 0:
+        return np.array([], dtype=np.intp)
+    # O(N) partition finds the k-th best score; only rows reaching it get sorted
+    kth_score = np.partition(scores, len(scores) - k)[len(scores) - k]
+    candidates = np.flatnonzero(scores >= kth_score)
+    order = np.argsort(-scores[candidates], kind='stable')
+    return candidates[order[:k]]
+
+# Memoized match_yarn_to_pattern results, keyed by pattern and DataFrame identity (LRU)
+MATCH_CACHE_SIZE = 32
+_match_cache = OrderedDict()
+
 def match_yarn_to_pattern(pattern_name, patterns_df, yarn_df, top_n=5):
-    """Find best yarn matches for a specific pattern."""
+    """Find best yarn matches for a specific pattern.
+    
+    Results are memoized per (pattern_name, top_n, patterns_df, yarn_df) object,
+    so the DataFrames must not be modified in place after the first call.
+    Callers get copies, so editing a result never affects later calls.
+    """
+    key = (pattern_name, top_n, id(patterns_df), id(yarn_df))
+    if key in _match_cache:
+        _match_cache.move_to_end(key)
+    else:
+        if len(_match_cache) >= MATCH_CACHE_SIZE:
+            _match_cache.popitem(last=False)  # evict the least recently used entry
+        # Keep the DataFrames referenced so their ids cannot be reused while cached
+        _match_cache[key] = (patterns_df, yarn_df, _match_yarn_to_pattern(pattern_name, patterns_df, yarn_df, top_n))
+    pattern_row, scores_df = _match_cache[key][2]
+    return pattern_row.copy(), scores_df.copy()
+
+def _match_yarn_to_pattern(pattern_name, patterns_df, yarn_df, top_n):
+    """Uncached body of match_yarn_to_pattern."""
     
     # Find the pattern
     pattern_row = patterns_df[patterns_df['Pattern Name'] == pattern_name].iloc[0]
     
     # Calculate scores for all yarns
-    scores = []
-    for idx, yarn_row in yarn_df.iterrows():
-        score = calculate_match_score(pattern_row, yarn_row)
-        scores.append({
-            'yarn_name': yarn_row['Name of the product'],
-            'score': score,
-            'price': yarn_row['Price (€)'],
-            'rating': yarn_row['Rating (★)'],
-            'yarn_weight': yarn_row['Yarn thikness'],
-            'hook_size': yarn_row['Needle/Hook Size (mm)'],
-            'cotton': yarn_row['Cotton (%)'],
-            'acrylic': yarn_row['Acrylic (%)'],
-            'wool': yarn_row['Wool (%)']
-        })
-    
-    # Sort by score
-    scores_df = pd.DataFrame(scores)
-    scores_df = scores_df.sort_values('score', ascending=False)
-    
-    return pattern_row, scores_df.head(top_n)
+    scores = calculate_match_scores_batch(pattern_row, yarn_df)
+    
+    # Keep the best top_n, highest score first
+    top_idx = top_k_indices(scores, top_n)
+    top_yarns = yarn_df.iloc[top_idx]
+    scores_df = pd.DataFrame({
+        'yarn_name': top_yarns['Name of the product'],
+        'score': scores[top_idx],
+        'price': top_yarns['Price (€)'],
+        'rating': top_yarns['_rating_f'],
+        'yarn_weight': top_yarns['Yarn thikness'],
+        'hook_size': top_yarns['Needle/Hook Size (mm)'],
+        'cotton': top_yarns['Cotton (%)'],
+        'acrylic': top_yarns['Acrylic (%)'],
+        'wool': top_yarns['Wool (%)']
+    })
+    
+    return pattern_row, scores_df
 
 def display_recommendations(pattern_row, recommendations):
     """Display yarn recommendations nicely."""